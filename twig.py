@@ -18,6 +18,9 @@
     Last Modified: 06-Nov-2024
 """
 import argparse
+import functools    # lru_cache()
+import itertools    # zip_longest()
+import operator     # itemgetter()
 import re
 import time
 import os           # splitext()
@@ -64,6 +67,22 @@ from openpyxl.utils import get_column_letter
 
 expand_names = False    # set this to True to write full names of teachers
 
+# patterns are compiled once here and shared by all functions below
+
+# format of a CLASSWISE line is "SUBJECT (1-3,5-6) TEACHER", e.g., MATH (1-3, 5) SK
+CLASSWISE_PATTERN = re.compile(r'^(?P<subject>[\w \-.]+)\s*\((?P<days>[1-6,\- ]+)\)\s*(?P<teacher>[A-Z]+)$')
+
+# format of a TEACHERWISE line is "CLASS (1-3,5-6) SUBJECT", e.g., 10A (1-2, 4) MATH
+TEACHERWISE_PATTERN = re.compile(r'^(?P<class_name>[\w]+)\s*\((?P<days>.*)\)\s*(?P<subject>[\w \-.]+)$')
+
+# styles are immutable, so the ones assigned to many cells are created once here
+GREY_FILL = PatternFill(start_color="FFC3C3C3", end_color="FFC3C3C3", fill_type="solid")    # ARGB: opaque grey
+TITLE_FONT = Font(size=25)
+HEADING_FONT = Font(size=16)
+CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='top', wrap_text=True)
+THIN_SIDE = Side(style='thin')
+THIN_BORDER = Border(left=THIN_SIDE, right=THIN_SIDE, top=THIN_SIDE, bottom=THIN_SIDE)
+
 
 # utility functions
 
@@ -74,13 +93,18 @@ def escape_special_chars(c):
         c = '\\t'
     return c
 
+@functools.lru_cache(maxsize=256)
 def expand_days(days):
     """
         Parameter
             days : eg. "1-2, 3, 4-6"
         
         Returns:
-            [1, 2, 3, 4, 5, 6]
+            (1, 2, 3, 4, 5, 6)
+
+        The same few day strings ("1-6", "1-3", ...) occur all over a timetable,
+        so results are cached; a tuple is returned so that callers cannot
+        modify the cached value.
     """
     ret = []
     if days.find(',') >= 0:
@@ -102,7 +126,7 @@ def expand_days(days):
                 ret.append(i)
         else:
             ret.append(int(days))
-    return ret
+    return tuple(ret)
 
 def compress_days(days):
     """
@@ -139,29 +163,102 @@ def compress_days(days):
 # print(compress_days([1, 2, 3, 4, 5, 6]))
 # exit(0)
 
+@functools.lru_cache(maxsize=256)
+def days_mask(days):
+    """
+        Parameter
+            days : eg. "1-2, 4"
+
+        Returns:
+            an int with bit d set for every day d, e.g. 0b10110
+    """
+    mask = 0
+    for day in expand_days(days):
+        mask |= 1 << day
+    return mask
+
+ALL_DAYS = 0b1111110    # days_mask("1-6")
+
+@functools.lru_cache(maxsize=256)
+def days_order(days):
+    """
+        sort key for day strings by the days themselves, so that "1-2" comes
+        before "1, 5" and "4-6" is the same as "6-4"
+    """
+    return tuple(sorted(set(expand_days(days))))
+
+def count_bits(mask):
+    return bin(mask).count('1')
+
+@functools.lru_cache(maxsize=256)
 def count_days(days):
-    return len(set(expand_days(days)))
+    return count_bits(days_mask(days))
 
-def count_periods(teacher, timetable):
-    period_count = {}
-    for period_info in timetable[teacher]:
-        column, class_name, days, subject = period_info
-        # print(period_info)
-        days = expand_days(days)
-        if column not in period_count:
-            period_count[column] = []
+@functools.lru_cache(maxsize=1024)
+def parse_classwise_cell(content, separator):
+    """
+        Parameter
+            content   : text of a CLASSWISE cell, e.g., "MATH (1-4) RN\nHINDI (5-6) MA"
+            separator : separator between the lines of the cell
 
-        period_count[column].extend(days)   # combine two lists
+        Returns:
+            a tuple of (line, (subject, days, teacher)) pairs, one for every line
+            that is neither empty nor a comment; the second item is None if the
+            line is not in "SUBJECT (DAYS) TEACHER" format
 
-    total_periods = 0
-    
-    for column in period_count:
-        periods = len(set(period_count[column]))   # remove duplicates
-        total_periods += periods
+        The same cell content repeats across classes and sections, so the
+        results are cached; the caller prints warnings for the bad lines.
+    """
+    entries = []
+    for line in content.split(separator):
+        line = line.strip()
+        if line == '' or line.startswith('#'):  # ignore empty lines and the ones starting with '#' -- used as comment
+            continue
 
-    return total_periods
+        m = CLASSWISE_PATTERN.match(line)
+        if m is None:   # no match
+            entries.append((line, None))
+            continue
 
+        subject, days, teacher = m.groups()
+        entries.append((line, (subject.strip(), days, teacher)))
+
+    return tuple(entries)
+
+@functools.lru_cache(maxsize=1024)
+def parse_teacherwise_cell(content, separator):
+    """
+        Parameter
+            content   : text of a TEACHERWISE cell, e.g., "10A (1-2, 4) MATH\n9B (5) MATH"
+            separator : separator between the lines of the cell
+
+        Returns:
+            a tuple of (line, (class_name, days, subject)) pairs, one for every
+            non-empty line; the second item is None if the line is not in
+            "CLASS (DAYS) SUBJECT" format
+
+        Cached like parse_classwise_cell(); the caller prints the warnings.
+    """
+    entries = []
+    for line in content.split(separator):
+        line = line.strip()
+        if line == "":
+            # skip empty lines
+            continue
+
+        m = TEACHERWISE_PATTERN.match(line)
+        if m is None:
+            entries.append((line, None))
+            continue
+
+        class_name, days, subject = m.groups()
+        entries.append((line, (class_name, days, subject.strip())))
+
+    return tuple(entries)
+
+@functools.lru_cache(maxsize=None)
 def get_formatted_time():
+    # computed once per run, so CLASSWISE and TEACHERWISE get the same time stamp
     # t = time.localtime()
     # return f"{t.tm_year}{t.tm_mon:02d}{t.tm_mday:02d}{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}"
     return "Last updated on " + time.ctime()
@@ -173,9 +270,7 @@ def load_teacher_names(workbook):
     
     teacher_names = {}
     
-    row = 2
-    while True:
-        teacher_code = sheet.cell(row, 1).value
+    for teacher_code, full_name in sheet.iter_rows(min_row=2, max_col=2, values_only=True):
         if teacher_code == None:
             break
 
@@ -183,8 +278,7 @@ def load_teacher_names(workbook):
             # teacher code has been repeated
             raise Exception(f"Teacher code '{teacher_code}' has been used more than once. Modify TEACHERS sheet to remove the error.")
 
-        teacher_names[teacher_code] = sheet.cell(row, 2).value # full name
-        row += 1
+        teacher_names[teacher_code] = full_name
 
     return teacher_names
 
@@ -195,9 +289,10 @@ def load_teacher_details(workbook):
     
     teacher_details = {}
     
-    row = 2
-    while True:
-        teacher_code = sheet.cell(row, 1).value
+    rows = sheet.iter_rows(max_col=5, values_only=True)
+    headers = next(rows, ())    # first row has the column names, e.g., NAME, GENDER
+    for values in rows:
+        teacher_code = values[0]
         if teacher_code == None:
             break
 
@@ -205,12 +300,7 @@ def load_teacher_details(workbook):
             # teacher code has been repeated
             raise Exception(f"Teacher code '{teacher_code}' has been used more than once. Modify TEACHERS sheet to remove the error.")
 
-        for col in range(1, 6):
-            if teacher_code not in teacher_details:
-                teacher_details[teacher_code] = {}
-            teacher_details[teacher_code][sheet.cell(1, col).value] = sheet.cell(row, col).value
-
-        row += 1
+        teacher_details[teacher_code] = dict(zip(headers, values))
 
     return teacher_details
 
@@ -227,15 +317,13 @@ def highlight_clashes(sheet, context):
     total_clashes = 0
 
     # format of line is "CLASS (1-3,5-6) SUBJECT", e.g., 10A (1-2, 4) MATH
-    p = re.compile(r'^(?P<class_name>[\w]+)\s*\((?P<days>.*)\)\s*(?P<subject>[\w \-.]+)$')
     
-    row = 2
-    while True:
-        if not sheet.cell(row=row, column=1).value:
+    for row, values in enumerate(sheet.iter_rows(min_row=2, max_col=9, values_only=True), start=2):
+        if not values[0]:
             break
 
         for column in range(2, 10):
-            content = sheet.cell(row, column).value
+            content = values[column - 1]
             # skip empty cells in class timetable with a warning
             if not content:
                 # cells in teacherwise timetable could be empty; just skip them
@@ -244,26 +332,18 @@ def highlight_clashes(sheet, context):
                 continue
             # content = content.replace('\n', ';')
             # lines = content.split(";")
-            lines = content.split(SEPARATOR) # SEPARATOR is "\n" or ;
             
-            entry = {}
+            entry = {}  # 'class-subject' -> mask of days, e.g., '10-SCI' -> 0b110
 
-            for line in lines:
-                line = line.strip()
-                if line == "":
-                    # skip empty lines
-                    continue
-
-                m = p.match(line)
-                if not m:
+            for line, parsed in parse_teacherwise_cell(content, SEPARATOR): # SEPARATOR is "\n" or ;
+                if parsed is None:
                     print(f"\nWarning: Cell {get_column_letter(column)}{row} in 'Teacherwise' timetable has formatting issue.")
                     print("    >>> ", line)
                     # warnings += 1
                     continue
-                class_name, days, subject = m.groups()
-                subject = subject.strip()
+                class_name, days, subject = parsed
                 # try:
-                days = expand_days(days)
+                days = days_mask(days)
                 # except:
                 #     print(f"\nERROR: (row={row}, column={column}) (Cell {get_column_letter(column)}{row}) in 'Teacherwise' timetable has formatting issue")
                 #     # print(e)
@@ -286,44 +366,43 @@ def highlight_clashes(sheet, context):
                     In Example 2 above, 2nd period: classes 10 and 9 simultaneously is a clash
                 """
 
-                for day in days:
-                    if not day in entry:
-                        entry[day] = []
-                    entry[day].append(get_class_number(class_name)+ '-' + subject)    # Eg., '10-SCI' (from 10A (1-6) SCI)
-                    # the above code now ensures that the case "7A (1) PE, 7B (1-4) MATH" is marked as a clash
-
-            # after all lines in a cell have been processed
-            clash_days = []
-            for day in entry:
-                entry[day] = set(entry[day])    # remove duplicates
-                if len(entry[day]) > 1:
-                    # possible clash
-                    clash_days.append(day)
+                label = get_class_number(class_name)+ '-' + subject    # Eg., '10-SCI' (from 10A (1-6) SCI)
+                entry[label] = entry.get(label, 0) | days
+                # keying on class-subject ensures that the case "7A (1) PE, 7B (1-4) MATH" is marked as a clash
+
+            # after all lines in a cell have been processed, a day is a clash
+            # if it is set in the masks of two different labels
+            seen = clash = 0
+            for label in entry:
+                clash |= seen & entry[label]
+                seen |= entry[label]
+
+            clash_days = [day for day in range(clash.bit_length()) if clash & (1 << day)]
 
             # if there are clashes, write them
             if len(clash_days) > 0:
                 total_clashes += len(clash_days)
                 # converts list [1, 2, 5] into a string
                 clash_days = repr(clash_days)
-                sheet.cell(row=row, column=column).value = CLASH_MARK + f"{clash_days}:\n" + sheet.cell(row=row, column=column).value
-
-        row += 1
+                sheet.cell(row=row, column=column).value = CLASH_MARK + f"{clash_days}:\n" + content
 
     return total_clashes
 
 def clear_sheet(sheet):
     # clear the sheet before starting writing...
-    row = 2
-    while True:
+    # find the last filled row first: row 2 and the rows below it
+    # up to the first empty cell in column 1
+    last_row = 2
+    for row, (name,) in enumerate(sheet.iter_rows(min_row=3, max_col=1, values_only=True), start=3):
+        if not name:
+            # we have reached EOF
+            break
+        last_row = row
 
+    for row in range(2, last_row + 1):
         for column in range(1, 11):
             sheet.cell(row=row, column=column).value = ""
 
-        row += 1
-        if not sheet.cell(row=row, column=1).value:
-            # we have reacher EOF
-            break
-
     return
 
 def generate_teacherwise(workbook, context):
@@ -343,21 +422,20 @@ def generate_teacherwise(workbook, context):
     # if names are to be replaced with full names for teachers,
     # then we must have 'TEACHERS' sheet in the input file
     teacher_names = {}
-    if "TEACHERS" in book:
+    if "TEACHERS" in workbook:
         print("Reading teacher details from 'TEACHERS' sheet... ", end='')
         teacher_names = load_teacher_names(workbook)
         print("done.")
 
     timetable = {}  # variable to hold teacherwise timetable
+    teacher_days = {}   # teacher -> {period: mask of days taught in that period}
 
     print("Processing timetable ...")
-    # p = re.compile(r'^(?P<subject>[\w -.]+)\s*\((?P<days>.*)\)\s*(?P<teacher>\w+)$') # format "SUBJECT (1-3,5-6) TEACHER"
-    p = re.compile(r'^(?P<subject>[\w \-.]+)\s*\((?P<days>[1-6,\- ]+)\)\s*(?P<teacher>[A-Z]+)$')
 
     warnings = 0
-    row = 2
-    while True:
-        class_name = input_sheet.cell(row, 1).value
+    row = 1
+    for row, values in enumerate(input_sheet.iter_rows(min_row=2, max_col=9, values_only=True), start=2):
+        class_name = values[0]
         if not class_name:
             # we have reached the end of CLASSWISE sheet, so stop further processing
             break
@@ -366,32 +444,24 @@ def generate_teacherwise(workbook, context):
 
         print(f"Class: {class_name}... ", end="")
         for column in range(2, 10):
-            content = input_sheet.cell(row, column).value
+            content = values[column - 1]
             # skip empty cells in class timetable with a warning
             if not content:
                 warnings += 1
                 print(f"Warning: Cell {get_column_letter(column)}{row} is empty.")
                 continue
 
-            lines = content.split(SEPARATOR) # SEPARATOR is "\n" or ;
-            
-            days_assigned = []
-            for line in lines:
-                line = line.strip()
-                if line == '' or line.startswith('#'):  # ignore empty lines and the ones starting with '#' -- used as comment
-                    continue
-
-                m = p.match(line)
-                if m is None:   # no match
+            days_assigned = 0
+            for line, entry in parse_classwise_cell(content, SEPARATOR): # SEPARATOR is "\n" or ;
+                if entry is None:   # no match
                     # print(f"\nWarning: (row={row}, column={column}) (Cell {get_column_letter(column)}{row}) has some formatting issue")
                     print(f"Warning: Cell {get_column_letter(column)}{row} in CLASSWISE sheet has some formatting issue.")
                     print("    >>> ", line)
                     warnings += 1
                     continue
 
-                subject, days, teacher = m.groups()
-                subject = subject.strip()
-                days_assigned.extend(expand_days(days))
+                subject, days, teacher = entry
+                days_assigned |= days_mask(days)
 
                 if subject not in periods_assigned:
                     # periods_assigned[subject] = expand_days(days)
@@ -404,14 +474,19 @@ def generate_teacherwise(workbook, context):
 
                 if teacher not in timetable:
                     timetable[teacher] = []
+                    teacher_days[teacher] = {}
                 
                 period = column                     # column denotes "period"
-                timetable[teacher].append((period, class_name, days, subject))
+                # the same few day and subject strings repeat on every line, so share one copy;
+                # the last item is the day-wise sort key used while writing TEACHERWISE
+                timetable[teacher].append((period, class_name, sys.intern(days), sys.intern(subject), days_order(days)))
 
-            if set(days_assigned) != set([1, 2, 3, 4, 5, 6]):
+                # OR-ing the masks removes days counted twice in the same period
+                teacher_days[teacher][period] = teacher_days[teacher].get(period, 0) | days_mask(days)
+
+            if days_assigned != ALL_DAYS:
                 warnings += 1
-                pending_days = set([1, 2, 3, 4, 5, 6]) - set(days_assigned)
-                pending_days = list(pending_days)
+                pending_days = [day for day in range(1, 7) if not days_assigned & (1 << day)]
 
                 print(f"Warning: {pending_days} days pending assignment in cell {get_column_letter(column)}{row}.")
 
@@ -435,10 +510,12 @@ def generate_teacherwise(workbook, context):
 
         print("done.")
         # process next class
+    else:
+        # no empty row after the last class; the time stamp goes just below it
         row += 1
-        # end while loop
+    # end for loop
 
-    ars = context['ARGS']
+    args = context['ARGS']
     if args.keepstamp:  # don't update time stamp on the original timetable
         pass
     else:
@@ -450,17 +527,17 @@ def generate_teacherwise(workbook, context):
     # count total periods for each teacher
     total_periods = {}
 
-    for teacher in timetable:
-        total_periods[teacher] = count_periods(teacher, timetable)
+    for teacher in teacher_days:
+        total_periods[teacher] = sum(count_bits(mask) for mask in teacher_days[teacher].values())
 
     # everything has been read into the timetable
     # now write back to the TEACHERWISE worksheet
 
-    if 'TEACHERWISE' in book:
-        output_sheet = book['TEACHERWISE']
+    if 'TEACHERWISE' in workbook:
+        output_sheet = workbook['TEACHERWISE']
     else:
         print("Creating TEACHERWISE sheet... ", end='')
-        output_sheet = book.create_sheet(title='TEACHERWISE', index=1)
+        output_sheet = workbook.create_sheet(title='TEACHERWISE', index=1)
         print("done.")
 
     # Clear the TEACHERWISE sheet before writing
@@ -483,8 +560,9 @@ def generate_teacherwise(workbook, context):
     # if a teacher is not in the TEACHERS sheet but appears in the timetable,
     # append him to the `sorted_teachers' as well so that his timetable can be generated
     # ensure every teacher in the timetable is has been appended
+    listed_teachers = set(sorted_teachers)  # set lookup keeps this loop linear
     for teacher in timetable_teachers:   # for every teachers in the classwise timetable ...
-        if teacher not in sorted_teachers:
+        if teacher not in listed_teachers:
             sorted_teachers.append(teacher)
 
     # start writing in 2nd row and then move to the following rows
@@ -501,17 +579,22 @@ def generate_teacherwise(workbook, context):
             output_sheet.cell(row, 1).value = teacher # abbreviation as has been used in classwise timetable
 
         # sort day-wise
-        periods = sorted(periods, key=lambda x:x[2])
+        periods = sorted(periods, key=operator.itemgetter(4))
 
+        # collect the lines of every period first and write each cell only once,
+        # instead of reading back and growing the cell value line by line
+        cells = {}
         for period in periods:
-            (column, class_name, days, subject) = period
+            (column, class_name, days, subject, _) = period
             class_name = class_name.strip()
-            if output_sheet.cell(row, column).value:
-                output_sheet.cell(row, column).value += f"{SEPARATOR}{class_name} ({days}) {subject}"
-            else:
-                output_sheet.cell(row, column).value = f"{class_name} ({days}) {subject}"
+            if column not in cells:
+                cells[column] = []
+            cells[column].append(f"{class_name} ({days}) {subject}")
+
+        for column in cells:
+            output_sheet.cell(row=row, column=column, value=SEPARATOR.join(cells[column]))
 
-        output_sheet.cell(row, 10).value = total_periods[teacher]
+        output_sheet.cell(row=row, column=10, value=total_periods[teacher])
 
         row += 1                    # move to the next row
         # end for
@@ -572,23 +655,29 @@ def generate_classwise(input_book, outfile):
     GENDER_COLUMN = 5
     INCHARGE_COLUMN = 6
     
-    row = 2
-    while True:
-        teacher_code = teachers_sheet.cell(row, 1).value
+    for values in teachers_sheet.iter_rows(min_row=2, max_col=INCHARGE_COLUMN, values_only=True):
+        teacher_code = values[0]
         if teacher_code is None or teacher_code == '':
             break
-        klass = teachers_sheet.cell(row, INCHARGE_COLUMN).value
+        klass = values[INCHARGE_COLUMN - 1]
         if klass is not None:
             class_incharge[klass] = teacher_code
 
-        row += 1
+    # read the CLASSWISE rows once; they are used both for creating the
+    # class sheets and for filling them up
+    class_rows = []
+    timestamp = None
+    for values in input_sheet.iter_rows(min_row=2, max_col=9, values_only=True):
+        if not values[0]:
+            # we have reached the end of CLASSWISE sheet
+            # the row after the last class holds the time stamp
+            timestamp = values[1]
+            break
+        class_rows.append(values)
 
     # copy/create templates for each class
-    row = 2
-    while True:
-        klass = input_sheet.cell(row, 1).value
-        if klass is None or klass == '':
-            break
+    class_names = [values[0] for values in class_rows]
+    for klass in class_names:
 
         # the following code effectively clears the sheet before writing any data
 
@@ -601,23 +690,19 @@ def generate_classwise(input_book, outfile):
         copy = output_book.copy_worksheet(master_sheet)
         copy.title = klass
 
-        row += 1
-
     # output_book.save(outfile)
 
     # set up loops and process
-    p = re.compile(r'^(?P<subject>[\w \-.]+)\s*\((?P<days>[1-6,\- ]+)\)\s*(?P<teacher>[A-Z]+)$')
-
     teacher_details = load_teacher_details(input_book)
     # print(teacher_details)
     
     warnings = 0
-    row = 2
-    while True:
+    # (sheet, r, column) -> lines of that cell; collected across all the rows
+    # since the same class may appear in more than one row of CLASSWISE
+    cells = {}
+    for row, values in enumerate(class_rows, start=2):
         # print(f"Input Sheet: {input_sheet.title} row={row}")
-        class_name = input_sheet.cell(row, 1).value
-        if not class_name:
-            break       # we have reached the end of CLASSWISE sheet, so stop further processing
+        class_name = values[0]
         
         sheet_name = class_name
         # write class name
@@ -636,49 +721,42 @@ def generate_classwise(input_book, outfile):
         
 
         for column in range(2, 10):
-            content = input_sheet.cell(row, column).value
+            content = values[column - 1]
             # skip empty cells in class timetable with a warning
             if not content:
                 warnings += 1
                 print(f"Warning: Cell {get_column_letter(column)}{row} is empty.")
                 continue
 
-            lines = content.split(SEPARATOR) # SEPARATOR is "\n" or ;
-            
-            
-            for line in lines:
-                line = line.strip()
-                if line == '' or line.startswith('#'):  # ignore empty lines and the ones starting with '#' -- used as comment
-                    continue
-
-                m = p.match(line)
-                if m is None:   # no match
+            for line, entry in parse_classwise_cell(content, SEPARATOR): # SEPARATOR is "\n" or ;
+                if entry is None:   # no match
                     # print(f"\nWarning: (row={row}, column={column}) (Cell {get_column_letter(column)}{row}) has some formatting issue")
                     print(f"Warning: Cell {get_column_letter(column)}{row} in CLASSWISE sheet has some formatting issue.")
                     print("    >>> ", line)
                     warnings += 1
                     continue
 
-                subject, days, teacher = m.groups()
-                subject = subject.strip()
+                subject, days, teacher = entry
                 days = expand_days(days)
 
-                # copy data to the respective classwise sheet
+                # collect data for the respective classwise sheet
                 for day in days:
                     r = day + 3     # variable "row" is already taken
-                    # print(f"output_book[{sheet_name}].cell({r}, {column}).value += {subject} ({teacher})")
-                    if output_book[sheet_name].cell(r, column).value is None:
-                        output_book[sheet_name].cell(r, column).value = ''
-                    output_book[sheet_name].cell(r, column).value += f"{subject} ({teacher})\n"
-        
-        row += 1
-        # end of while True loop
+                    if (sheet_name, r, column) not in cells:
+                        cells[(sheet_name, r, column)] = []
+                    cells[(sheet_name, r, column)].append(f"{subject} ({teacher})\n")
+
+        # end of for loop
+
+    # copy data to the respective classwise sheets, one write per cell;
+    # the lines are appended to whatever the cell already holds (e.g., text from MASTER)
+    for (sheet_name, r, column), lines in cells.items():
+        cell = output_book[sheet_name].cell(r, column)
+        cell.value = (cell.value or '') + ''.join(lines)
 
-    # get the time stamp from the CLASSWISE sheet
-    timestamp = input_sheet.cell(row, 2).value
-    for ws in output_book:
-        if ws.title[0].isdigit():
-            ws.cell(10, 2).value = timestamp
+    # the time stamp from the CLASSWISE sheet was picked up while reading the rows
+    for klass in class_names:
+        output_book[klass].cell(10, 2).value = timestamp
 
     # save everything to the file
     output_book.save(outfile)
@@ -686,36 +764,32 @@ def generate_classwise(input_book, outfile):
     return warnings
     # end generate_classwise(filename)
 
-def get_teachers_in_cell(ws, cell_name):
-    p = re.compile(r'^(?P<subject>[\w \-.]+)\s*\((?P<days>[1-6,\- ]+)\)\s*(?P<teacher>[A-Z]+)$')
-    content = ws[cell_name].value
-    lines = content.split(SEPARATOR)
+def get_teachers_in_cell(content, cell_name):
+    if not content:
+        # the cell is empty in one of the timetables
+        return []
     teachers = []
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-        m = p.match(line)
-        if not m:
-            print(lines)
+    for line, entry in parse_classwise_cell(content, SEPARATOR):
+        if entry is None:
+            print(content.split(SEPARATOR))
             raise Exception(f"Error: {cell_name} is not in correct format.")
-        subject, days, teacher = m.groups()
+        subject, days, teacher = entry
         teachers.append(teacher)
 
     return teachers
 
-def get_affected_teachers(ws_base, ws_current, cell_name):
+def get_affected_teachers(base_content, current_content, cell_name):
     # simplest implementation is to consider every teacher in the corresponding cells as affected
     
-    # read names of teachers in both sheets
+    # read names of teachers in both cells
     teachers = []
-    # first, read from base sheet
-    teachers.extend(get_teachers_in_cell(ws_base, cell_name))
-    teachers.extend(get_teachers_in_cell(ws_current, cell_name))
+    # first, read from base cell
+    teachers.extend(get_teachers_in_cell(base_content, cell_name))
+    # then, from the current cell
+    teachers.extend(get_teachers_in_cell(current_content, cell_name))
     teachers = list(set(teachers))    # remove duplicates
 
     return teachers   # re-convert to list
-    # read from the current sheet
     
 def show_differences(base, current):
     """
@@ -726,40 +800,54 @@ def show_differences(base, current):
     """
 
     # load the two  workbooks
-    wb_base = openpyxl.load_workbook(base)
-    wb_current = openpyxl.load_workbook(current)
+    # both are only read while comparing, so stream them in read-only mode
+    wb_base = openpyxl.load_workbook(base, read_only=True)
+    wb_current = openpyxl.load_workbook(current, read_only=True)
 
     ws_base = wb_base['CLASSWISE']
     ws_current = wb_current['CLASSWISE']
 
+    # walk both sheets row by row in lockstep; a missing row in current reads as empty
+    base_rows = ws_base.iter_rows(min_row=2, max_col=9, values_only=True)
+    current_rows = ws_current.iter_rows(min_row=2, max_col=9, values_only=True)
+
     differences = []
-    affected_teachers = []
-    row = 2
-    while True:
-        class_name = ws_base.cell(row, 1).value
+    changed_cells = []      # (row, col) of every difference
+    affected_teachers = set()   # a set removes duplicates as we go
+    for row, (base_values, current_values) in enumerate(itertools.zip_longest(base_rows, current_rows, fillvalue=(None,) * 9), start=2):
+        class_name = base_values[0]
         if class_name is None:
             break
 
         for col in range(1, 10):
-            cell_name = f"{get_column_letter(col)}{row}"
-            if ws_base.cell(row, col).value != ws_current.cell(row, col).value:
+            base_value = base_values[col - 1]
+            current_value = current_values[col - 1]
+            if base_value != current_value:
+                cell_name = f"{get_column_letter(col)}{row}"
                 differences.append(cell_name)
                 # print(f"Difference in {cell_name}")
-                teachers = get_affected_teachers(ws_base, ws_current, cell_name)
+                teachers = get_affected_teachers(base_value, current_value, cell_name)
                 # print(teachers)
-                affected_teachers.extend(teachers)
-                # color code the change in the current in ws_current
-                ws_current.cell(row, col).fill = PatternFill(start_color="c3c3c3", end_color="c3c3c3", fill_type="solid")
+                affected_teachers.update(teachers)
+                changed_cells.append((row, col))
 
-        row += 1
+    # read-only workbooks keep the file open until closed
+    wb_base.close()
+    wb_current.close()
 
-    affected_teachers = set(affected_teachers)  # remove duplicates
-    affected_teachers = list(affected_teachers) # re-convert to list
     print("Differences found in cells: ", ', '.join(differences))
-    print(f"Likely affected teachers are: ", ', '.join(affected_teachers)+'.')
+    print(f"Likely affected teachers are: ", ', '.join(sorted(affected_teachers))+'.')
+
+    if changed_cells:
+        # re-open current for writing and color code the changes in it
+        wb_current = openpyxl.load_workbook(current)
+        ws_current = wb_current['CLASSWISE']
+        for row, col in changed_cells:
+            ws_current.cell(row, col).fill = GREY_FILL
+
+        # save the changes to "current" file
+        wb_current.save(current)
 
-    # save the changes to "current" file
-    wb_current.save(current)
     # return number of differences found
     return len(differences)
 
@@ -778,40 +866,94 @@ def format_master_ws(ws):
     
     # shade the row showing periods (3rd row)
     for col in range(1, 10):
-        ws[get_column_letter(col)+'3'].fill = PatternFill(start_color="c3c3c3", end_color="c3c3c3", fill_type="solid")
+        ws.cell(3, col).fill = GREY_FILL
     # shade the days in Column A
     for row in range(4, 10):
-        ws['A'+str(row)].fill = PatternFill(start_color="c3c3c3", end_color="c3c3c3", fill_type="solid")
+        ws.cell(row, 1).fill = GREY_FILL
 
     # format header
     ws.merge_cells('A1:I1')
     ws.merge_cells('A2:D2')
     ws.merge_cells('E2:I2')
 
-    ws['A1'].font = Font(size=25)
-    ws['A2'].font = Font(size=16)
-    ws['E2'].font = Font(size=16)
+    ws['A1'].font = TITLE_FONT
+    ws['A2'].font = HEADING_FONT
+    ws['E2'].font = HEADING_FONT
 
-    alignment = Alignment(horizontal='center', vertical='top', wrap_text=True)
-    ws['A1'].alignment = alignment # school name
+    ws['A1'].alignment = CENTER_ALIGNMENT # school name
     ws['A2'].alignment = Alignment(horizontal='left', vertical='top')   # Class
     ws['E2'].alignment = Alignment(horizontal='right', vertical='top')  # Incharge
 
-    # Define the border style
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # thin border around the period grid
     for row in range(3, 10):
         for col in range(1, 10):
-            ws.cell(row, col).border = thin_border
-            ws.cell(row, col).alignment = alignment
+            cell = ws.cell(row, col)
+            cell.border = THIN_BORDER
+            cell.alignment = CENTER_ALIGNMENT
 
     return
     # end format_master_ws()
 
+# handlers for the subcommands
+
+def run_teacherwise(context):
+    args = context['ARGS']
+    if not args.infile:
+        filename = 'Timetable.xlsx'
+    else:
+        filename = args.infile
+
+    print(f"Reading CLASSWISE timetable from '{filename}'... ", end="")
+    # TEACHERWISE is written back into the same workbook, so load it in full
+    book = openpyxl.load_workbook(filename)
+    print("done.")
+
+    warnings = generate_teacherwise(book, context)
+    teacherwise_sheet = book['TEACHERWISE']
+    
+    # Highlight possible clashes
+    total_clashes = highlight_clashes(teacherwise_sheet, context)
+
+    book.save(filename)
+    print(f"Teacherwise timetable saved to TEACHERWISE sheet of '{filename}'.")
+
+    print(f"Clashes: {total_clashes}")
+    print(f"Warnings: {warnings}")
+
+def run_classwise(context):
+    args = context['ARGS']
+    if not args.infile:
+        filename = 'Timetable.xlsx'
+    else:
+        filename = args.infile
+
+    print(f"Reading CLASSWISE timetable from '{filename}'... ", end="")
+    # the input workbook is only read, so it can be streamed
+    book = openpyxl.load_workbook(filename, read_only=True)
+    print("done.")
+
+    warnings = generate_classwise(book, args.outfile)
+    book.close()
+    print(f"Classwise timetables saved to '{args.outfile}'.")
+    if warnings:
+        print(f"Warnings: {warnings}")
+
+def run_diff(context):
+    args = context['ARGS']
+    base = args.base
+    current = args.current
+
+    # compare "base" with "current"
+    print(f"Comparing '{base}' with '{current}' ..." )
+    differences = show_differences(base, current)
+    print(f"Found {differences} differences between {base} and {current}.")
+
+COMMANDS = {
+    'teacherwise' : run_teacherwise,
+    'classwise' : run_classwise,
+    'diff' : run_diff,
+}
+
 if __name__ == '__main__':
 
     ##########################################################
@@ -875,48 +1017,14 @@ if __name__ == '__main__':
         'ARGS' : args
     }
 
-    if args.command in ['teacherwise', 'classwise']:
-        if not args.infile:
-            filename = 'Timetable.xlsx'
-        else:
-            filename = args.infile
-
-        print(f"Reading CLASSWISE timetable from '{filename}'... ", end="")
-        book = openpyxl.load_workbook(filename)
-        print("done.")
-
-    if args.command == 'classwise':
-        warnings = generate_classwise(book, args.outfile)
-        print(f"Classwise timetables saved to '{args.outfile}'.")
-        if warnings:
-            print(f"Warnings: {warnings}")
-    elif args.command == 'teacherwise':
-        warnings = generate_teacherwise(book, context)
-        context = {'SEPARATOR': SEPARATOR}
-        teacherwise_sheet = book['TEACHERWISE']
-        
-        # Highlight possible clashes
-        total_clashes = highlight_clashes(teacherwise_sheet, context)
-
-        book.save(filename)
-        print(f"Teacherwise timetable saved to TEACHERWISE sheet of '{filename}'.")
-
-        print(f"Clashes: {total_clashes}")
-        print(f"Warnings: {warnings}")
-    elif args.command == 'diff':
-        base = args.base
-        current = args.current
-
-        # compare "base" with "current"
-        print(f"Comparing '{base}' with '{current}' ..." )
-        differences = show_differences(base, current)
-        print(f"Found {differences} differences between {base} and {current}.")
-    else:
+    handler = COMMANDS.get(args.command)
+    if handler is None:
         print("twig.py -- timetable manipulation utility")
         print("Copyright (c) 2024 Sunil Sangwal <sunil.sangwal@gmail.com>")
         print("Type 'python twig.py -h' for more information.")
         exit(0)
-        
+
+    handler(context)
 
     endTime = time.time()
     print("Finished processing in %.3f seconds." % (endTime - startTime))